@@ -1,28 +1,118 @@
 # agents.py
-import json
 import time
-from gemini_client import decide_and_create_challenge, verify_with_ai
+import hashlib
+import functools
+import orjson
+from urllib.parse import quote
+from gemini_client import Challenge, challenge_pool, verify_batcher
 from captcha_generator import (
-    create_image_from_description,
-    create_audio_from_text,
-    create_color_image,
-    prepare_pattern_ui
+    render_image_from_description,
+    render_color_image,
+    synthesize_audio,
+    prefetch_audio,
+    pil_to_bytes,
+    prepare_pattern_ui,
+    IMAGE_MIMETYPE,
+    AUDIO_MIMETYPE
 )
 from security import sign_payload, verify_signature
 from sessions import session_store
 
+# A captcha this young (and not yet attempted) is handed back as-is on a repeat
+# /captcha hit, so double-clicks and reloads don't re-run the AI call + render.
+REUSE_SECONDS = 5
+
+# Validate rate limit: after MAX_ATTEMPTS, further attempts must be at least
+# ATTEMPT_WINDOW_SECONDS apart.
+MAX_ATTEMPTS = 6
+ATTEMPT_WINDOW_SECONDS = 60
+
+def _render_seed(captcha_id):
+    # builtin hash() is salted per process; this stays stable across workers
+    digest = hashlib.blake2b(str(captcha_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+# Rendered media is memoized by its inputs. The seed is unique per captcha_id,
+# so entries are never shared between captchas; the cache only serves repeat
+# /media fetches of the same captcha (reloads, <audio> range requests).
+RENDER_CACHE_SIZE = 1024
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _render_image(desc, seed):
+    return pil_to_bytes(render_image_from_description(desc, seed=seed))
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _render_color(rgb, seed):
+    return pil_to_bytes(render_color_image(rgb, seed=seed))
+
+# Image/audio/color media is not rendered by /captcha. The session keeps a
+# render recipe {"kind", "args"} and /media/<sid> renders it when the client
+# actually loads it, so abandoned captchas cost nothing and the bytes are sent
+# raw instead of base64-inflated inside the JSON.
+_MEDIA_RENDERERS = {
+    "image": (_render_image, IMAGE_MIMETYPE),
+    "audio": (synthesize_audio, AUDIO_MIMETYPE),  # cached by captcha_generator
+    "color": (_render_color, IMAGE_MIMETYPE),
+}
+
+def _media_url(session_id, challenge):
+    # the captcha id only busts browser caches between captchas of one session
+    return f"/media/{session_id}?c={quote(str(challenge.captcha_id))}"
+
+def _fallback_challenge(challenge, error):
+    # simple text captcha used whenever a challenge can't be prepared or rendered
+    fallback_word = "solara" + str(int(time.time()) % 10000)
+    return Challenge(
+        captcha_id=challenge.captcha_id or "fallback-" + str(int(time.time())),
+        captcha_type="text",
+        instructions=f"Type the word '{fallback_word}'",
+        ui_data={"question": f"Type the word '{fallback_word}'"},
+        solution={"value": fallback_word},
+        metadata={"fallback": True, "render_error": str(error)}
+    )
+
+def _captcha_entry(session_id, challenge, media):
+    # Sign a SHA-256 digest of the canonical bytes and keep the digest next to
+    # the signature, so validate re-checks 32 bytes instead of re-serializing
+    # the challenge. The media recipe is display-only and is not signed.
+    # orjson serializes the dataclass natively (fields in declaration order).
+    challenge_digest = hashlib.sha256(orjson.dumps(challenge, option=orjson.OPT_SORT_KEYS)).digest()
+    return {
+        "challenge": challenge,
+        "challenge_digest": challenge_digest,
+        "signature": sign_payload(session_id, challenge_digest),
+        "media": media,
+        "created": time.time()
+    }
+
+def _client_view(challenge, signature, media_url=None):
+    return {
+        "captcha_id": challenge.captcha_id,
+        "captcha_type": challenge.captcha_type,
+        "instructions": challenge.instructions,
+        "ui_data": challenge.ui_data,
+        "signature": signature,
+        "media_url": media_url
+    }
+
 class GeneratorAgent:
     def run(self, session_id):
         session = session_store.get(session_id)
         if not session:
             return {"error": "invalid-session"}
 
-        # 1) Ask AI or fallback generator to produce a challenge
-        challenge = decide_and_create_challenge(session_id)
+        existing = session.captcha
+        if existing and session_store.rate.count(session_id) == 0 and time.time() - existing["created"] < REUSE_SECONDS:
+            media_url = _media_url(session_id, existing["challenge"]) if existing.get("media") else None
+            return _client_view(existing["challenge"], existing["signature"], media_url)
+
+        # 1) Take a pre-generated AI challenge (or generate one live / locally)
+        challenge = challenge_pool.take(session_id)
 
-        ctype = challenge.get("captcha_type")
-        ui_data = challenge.get("ui_data", {}) or {}
-        rendered_ui = dict(ui_data)  # copy for storing+returning
+        ctype = challenge.captcha_type
+        ui_data = challenge.ui_data
+        seed = _render_seed(challenge.captcha_id)
+        media = None  # render recipe for /media/<sid>
 
         try:
             # -------------------
@@ -30,23 +120,22 @@ class GeneratorAgent:
             # -------------------
             if ctype == "image":
                 desc = ui_data.get("description", "")
-                seed = hash(challenge.get("captcha_id"))
-                rendered_ui["image_base64"] = create_image_from_description(desc, seed=seed)
+                media = {"kind": "image", "args": (desc, seed)}
 
             # -------------------
             # AUDIO CAPTCHA
             # -------------------
             elif ctype == "audio":
                 text = ui_data.get("text", "")
-                rendered_ui["audio_base64"] = create_audio_from_text(text)
+                media = {"kind": "audio", "args": (text,)}
+                prefetch_audio(text)
 
             # -------------------
             # PATTERN CAPTCHA
             # -------------------
             elif ctype == "pattern":
                 shapes = ui_data.get("shapes", [])
-                seed = hash(challenge.get("captcha_id"))
-                rendered_ui = prepare_pattern_ui(shapes, seed=seed)
+                challenge.ui_data = prepare_pattern_ui(shapes, seed=seed)
 
             # -------------------
             # COLOR CAPTCHA
@@ -54,8 +143,7 @@ class GeneratorAgent:
             elif ctype == "color":
                 rgb = ui_data.get("color_rgb")
                 if isinstance(rgb, list) and len(rgb) == 3:
-                    seed = hash(challenge.get("captcha_id"))
-                    rendered_ui["image_base64"] = create_color_image(tuple(rgb), seed=seed)
+                    media = {"kind": "color", "args": (tuple(rgb), seed)}
                 else:
                     raise Exception("Invalid color_rgb")
 
@@ -73,75 +161,74 @@ class GeneratorAgent:
                 raise Exception(f"Unsupported captcha_type '{ctype}'")
 
         except Exception as e:
-            # If ANY rendering fails → fallback simple text CAPTCHA
-            fallback_word = "solara" + str(int(time.time()) % 10000)
-            challenge = {
-                "captcha_id": challenge.get("captcha_id", "fallback-" + str(int(time.time()))),
-                "captcha_type": "text",
-                "instructions": f"Type the word '{fallback_word}'",
-                "ui_data": {"question": f"Type the word '{fallback_word}'"},
-                "solution": {"value": fallback_word},
-                "metadata": {"fallback": True, "render_error": str(e)}
-            }
-            rendered_ui = challenge["ui_data"]
+            # If the challenge data is unusable (bad color, unknown type, pattern
+            # UI fails) → fallback simple text CAPTCHA. Media is rendered later,
+            # and MediaAgent falls back the same way when that fails.
+            media = None
+            challenge = _fallback_challenge(challenge, e)
 
         # 2) Save challenge + signature in session store
-        challenge_to_store = dict(challenge)
-        challenge_to_store["ui_data"] = rendered_ui
-
-        challenge_repr = json.dumps(challenge_to_store, sort_keys=True, ensure_ascii=False)
-        signature = sign_payload(session_id, challenge_repr)
-
+        entry = _captcha_entry(session_id, challenge, media)
         session_store.update(session_id, {
-            "captcha": {
-                "challenge": challenge_to_store,
-                "signature": signature,
-                "created": time.time()
-            },
-            "attempts": 0,
-            "last_attempt": 0,
-            "generation_count": session.get("generation_count", 0) + 1
+            "captcha": entry,
+            "generation_count": session.generation_count + 1
         })
+        session_store.rate.reset(session_id)
 
         # 3) Return minimal challenge to client
-        return {
-            "captcha_id": challenge_to_store.get("captcha_id"),
-            "captcha_type": challenge_to_store.get("captcha_type"),
-            "instructions": challenge_to_store.get("instructions"),
-            "ui_data": challenge_to_store.get("ui_data"),
-            "signature": signature
-        }
+        media_url = _media_url(session_id, challenge) if media else None
+        return _client_view(challenge, entry["signature"], media_url)
 
 
-class ValidatorAgent:
-    def run(self, session_id, user_answer):
+class MediaAgent:
+    def run(self, session_id):
         session = session_store.get(session_id)
-        if not session or not session.get("captcha"):
-            return {"success": False, "error": "No active captcha"}
+        if not session or not session.captcha:
+            return {"error": "No active captcha"}
+
+        captcha = session.captcha
+        media = captcha.get("media")
+        if not media:
+            return {"error": "no-media"}
+
+        render, mimetype = _MEDIA_RENDERERS[media["kind"]]
+        try:
+            body = render(*media["args"])
+        except Exception as e:
+            # Swap in a signed text captcha so the user can still solve one (the
+            # page re-fetches /captcha and gets it via the reuse window). Only
+            # replace the captcha that failed: a newer one may have been
+            # generated since the get() above.
+            fallback = _captcha_entry(session_id, _fallback_challenge(captcha["challenge"], e), None)
+            with session_store.transaction(session_id) as current:
+                if current and current.captcha is captcha:
+                    current.captcha = fallback
+                    session_store.rate.reset(session_id)
+            return {"error": "render-failed", "meta": str(e)}
 
-        stored = session["captcha"]
-        challenge = stored.get("challenge")
-        signature = stored.get("signature")
+        return {"body": body, "mimetype": mimetype}
 
-        # 1) Verify signature integrity
-        challenge_repr = json.dumps(challenge, sort_keys=True, ensure_ascii=False)
-        if not verify_signature(session_id, challenge_repr, signature):
-            return {"success": False, "error": "Stored challenge failed signature verification"}
 
-        # 2) Rate limiting
-        now = time.time()
-        attempts = session.get("attempts", 0)
-        last = session.get("last_attempt", 0)
-        if attempts >= 6 and now - last < 60:
-            return {"success": False, "error": "Too many attempts. Try again later."}
+class ValidatorAgent:
+    def run(self, session_id, user_answer):
+        with session_store.transaction(session_id) as session:
+            stored = session.captcha if session else None
+            if not stored:
+                return {"success": False, "error": "No active captcha"}
 
-        # 3) AI verification or local fallback
-        verify_result = verify_with_ai(challenge, user_answer)
+            # 1) Verify signature integrity
+            challenge_digest = stored.get("challenge_digest")
+            if not challenge_digest or not verify_signature(session_id, challenge_digest, stored.get("signature")):
+                return {"success": False, "error": "Stored challenge failed signature verification"}
 
-        session_store.update(session_id, {
-            "attempts": attempts + 1,
-            "last_attempt": now
-        })
+            # 2) Rate limiting (counts this attempt if allowed)
+            if not session_store.rate.try_attempt(session_id, time.time(), MAX_ATTEMPTS, ATTEMPT_WINDOW_SECONDS):
+                return {"success": False, "error": "Too many attempts. Try again later."}
+
+        # 3) AI verification or local fallback (batched with concurrent validates).
+        # Runs outside the transaction: the store lock must not be held across a model call.
+        challenge = stored["challenge"]
+        verify_result = verify_batcher.submit(challenge, user_answer).result()
 
         if not verify_result.get("ok"):
             return {
@@ -156,7 +243,13 @@ class ValidatorAgent:
         normalized = verify_result.get("normalized") or verify_result.get("normalized_answer")
 
         if correct:
-            session_store.update(session_id, {"captcha": None, "attempts": 0})
+            with session_store.transaction(session_id) as session:
+                # consume exactly the captcha that was verified; if a concurrent
+                # request already solved it or a new one was generated, don't pass
+                if not session or session.captcha is not stored:
+                    return {"success": False, "error": "No active captcha"}
+                session.captcha = None
+            session_store.rate.reset(session_id)
             return {
                 "success": True,
                 "message": "Captcha correct",
@@ -1,15 +1,37 @@
 # app.py
-from flask import Flask, request, jsonify, render_template_string
+import io
+import os
+import gzip
+import hashlib
+import orjson
+from flask import Flask, Response, request, send_file
 from dotenv import load_dotenv
 load_dotenv()
 
+try:
+    import brotli
+except ImportError:  # optional; the index is still served gzip-compressed
+    brotli = None
+
 from sessions import session_store
-from agents import GeneratorAgent, ValidatorAgent
+from agents import GeneratorAgent, MediaAgent, ValidatorAgent
 
 app = Flask(__name__, static_folder="static", static_url_path="/static")
 generator = GeneratorAgent()
+media = MediaAgent()
 validator = ValidatorAgent()
 
+@app.after_request
+def cache_static_fonts(response):
+    # versioned font URLs (?v=<content hash>) never change; let browsers keep them for a year
+    if request.path.startswith("/static/fonts/") and request.args.get("v") and response.status_code == 200:
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+def json_response(data):
+    # orjson writes UTF-8 bytes directly; cheaper than jsonify for base64-heavy payloads
+    return app.response_class(orjson.dumps(data), mimetype="application/json")
+
 INDEX_HTML = """
 <!doctype html>
 <html>
@@ -18,7 +40,7 @@ INDEX_HTML = """
   <title>DARKGLASS VERIFY</title>
   <meta name="viewport" content="width=device-width,initial-scale=1">
 
-  <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap" rel="stylesheet">
+  <!--FONTS-->
 
   <style>
     :root {
@@ -241,11 +263,26 @@ function renderCaptcha(data){
 
   const type = data.captcha_type;
   const ui = data.ui_data || {};
+  // image/audio/color media is fetched from its own URL, rendered on demand.
+  // If rendering fails the server swaps in a text captcha: fetch it once.
+  const mediaFailed = async () => {
+    if(!data.retried){
+      try {
+        const r = await fetch(`/captcha/${sessionId}`);
+        const j = await r.json();
+        if(!j.error){ j.retried = true; renderCaptcha(j); return; }
+      } catch (err) {
+        console.error(err);
+      }
+    }
+    document.getElementById("result").innerText = "✘ Failed to load captcha media, generate a new one";
+  };
 
   // IMAGE CAPTCHA
   if(type === "image"){
     const img = new Image();
-    img.src = ui.image_base64;
+    img.onerror = mediaFailed;
+    img.src = data.media_url;
     img.onload = () => {
       const canvas = document.createElement("canvas");
       canvas.width = img.width;
@@ -270,7 +307,8 @@ function renderCaptcha(data){
   if(type === "audio"){
     const a=document.createElement("audio");
     a.controls=true;
-    a.src=ui.audio_base64;
+    a.onerror=mediaFailed;
+    a.src=data.media_url;
     area.appendChild(a);
     renderInput(area, ui.hint || "Type what you hear", verify);
     return;
@@ -334,7 +372,8 @@ if(type === "pattern"){
   if(type === "color"){
     const img=new Image();
     img.className="color-box";
-    img.src=ui.image_base64;
+    img.onerror=mediaFailed;
+    img.src=data.media_url;
     area.appendChild(img);
     renderInput(area, ui.hint || "Enter color name or hex", verify);
     return;
@@ -392,26 +431,73 @@ async function verify(answer){
 </html>
 """
 
+# The page has no template variables, so it is encoded and compressed once at
+# startup instead of going through Jinja on every load.
+# Inter is self-hosted from static/fonts/ (OFL, Latin subset), saving the
+# third-party round trip to Google Fonts. The URLs carry a content hash so they
+# can be cached as immutable.
+FONT_DIR = os.path.join(app.static_folder, "fonts")
+FONT_WEIGHTS = {400: "Inter Regular", 600: "Inter SemiBold", 700: "Inter Bold"}
+
+def _font_head():
+    urls = {}
+    for weight in FONT_WEIGHTS:
+        with open(os.path.join(FONT_DIR, f"inter-{weight}.woff2"), "rb") as f:
+            version = hashlib.sha256(f.read()).hexdigest()[:12]
+        urls[weight] = f"/static/fonts/inter-{weight}.woff2?v={version}"
+    faces = "\n".join(
+        f"    @font-face {{ font-family: 'Inter'; font-weight: {weight}; font-display: swap; "
+        f"src: local('{name}'), url({urls[weight]}) format('woff2'); }}"
+        for weight, name in FONT_WEIGHTS.items()
+    )
+    return (
+        f'<link rel="preload" href="{urls[400]}" as="font" type="font/woff2" crossorigin>\n'
+        f"  <style>\n{faces}\n  </style>"
+    )
+
+_INDEX_RAW = INDEX_HTML.replace("<!--FONTS-->", _font_head()).encode("utf-8")
+_INDEX_ETAG = hashlib.sha256(_INDEX_RAW).hexdigest()[:16]
+_INDEX_BODIES = {"gzip": gzip.compress(_INDEX_RAW, compresslevel=9)}
+if brotli is not None:
+    _INDEX_BODIES["br"] = brotli.compress(_INDEX_RAW)
+
 @app.route("/", methods=["GET"])
 def index():
-    return render_template_string(INDEX_HTML)
+    # Accept's `in` ignores quality; q=0 means the client refuses that encoding
+    encoding = next((e for e in ("br", "gzip") if e in _INDEX_BODIES and request.accept_encodings[e] > 0), None)
+    etag = f"{_INDEX_ETAG}-{encoding}" if encoding else _INDEX_ETAG
+    headers = {"Cache-Control": "public, max-age=3600", "ETag": f'"{etag}"', "Vary": "Accept-Encoding"}
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        return Response(_INDEX_BODIES[encoding], mimetype="text/html", headers=headers)
+    return Response(_INDEX_RAW, mimetype="text/html", headers=headers)
 
 @app.route("/session", methods=["POST"])
 def create_session():
     sid = session_store.create()
-    return jsonify({"session_id": sid})
+    return json_response({"session_id": sid})
 
 @app.route("/captcha/<session_id>", methods=["GET"])
 def get_captcha(session_id):
     result = generator.run(session_id)
-    return jsonify(result)
+    return json_response(result)
+
+@app.route("/media/<session_id>", methods=["GET"])
+def get_media(session_id):
+    result = media.run(session_id)
+    if "error" in result:
+        return json_response(result), 404
+    # send_file streams from the buffer in blocks and answers Range requests
+    # (browsers fetch <audio> in ranges) without copying the body again
+    response = send_file(io.BytesIO(result["body"]), mimetype=result["mimetype"], etag=False, conditional=True)
+    response.headers["Cache-Control"] = "private, no-store"
+    return response
 
 @app.route("/validate/<session_id>", methods=["POST"])
 def validate(session_id):
     payload = request.get_json() or {}
     answer = payload.get("answer")
     result = validator.run(session_id, answer)
-    return jsonify(result)
-
-if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    return json_response(result)
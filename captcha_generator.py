@@ -3,26 +3,56 @@
 Enhanced CAPTCHA media renderer.
 
 Provides:
- - create_image_from_description(description, width, height, seed)
+ - render_image_from_description(description, width, height, seed)
      Renders noisy images that may contain text (word-based) or decorative patterns.
      If the AI description implies a click-point solution, it will NOT guess the solution;
      the server rendering is only visual. The canonical solution must come from the AI.
- - create_color_image(color_rgb, width, height, seed)
-     Renders a simple colored rectangle with optional pattern/noise and returns a PNG data URI.
- - create_audio_from_text(text, lang)
-     Uses gTTS (unchanged) to synthesize audio and return a data URI (mp3).
+ - render_color_image(color_rgb, width, height, seed)
+     Renders a simple colored rectangle with optional pattern/noise.
+ - synthesize_audio(text, lang)
+     Uses gTTS to synthesize audio and return mp3 bytes, cached in memory and
+     on disk (TTS_CACHE_DIR) since captcha phrases repeat a lot.
+ - prefetch_audio(text, lang)
+     Starts synthesis on a background pool; synthesize_audio joins it.
+ - pil_to_bytes(img, fmt) / pil_to_data_uri(img, fmt)
+     Encode a rendered image (WebP by default, PNG if Pillow lacks WebP) as raw
+     bytes or a data URI.
+ - create_image_from_description / create_color_image / create_audio_from_text
+     Data-URI conveniences over the renderers above.
  - prepare_pattern_ui(shapes, seed)
      Returns a shapes list and a hint; client renders a clickable sequence UI.
 """
 
 import io
-import base64
-import random
+import os
 import math
+import re
+import time
+import random
+import hashlib
+import tempfile
+import threading
+import warnings
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, List, Dict, Any
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, features
 from gtts import gTTS
 
+# Pillow-SIMD (vectorized GaussianBlur/resize) is a drop-in build of Pillow and
+# tags its versions ".postN"; plain Pillow >= 9.2 works too, just slower.
+PILLOW_SIMD = ".post" in PIL.__version__
+if not PILLOW_SIMD:
+    warnings.warn(f"Pillow {PIL.__version__} is not the Pillow-SIMD build; "
+                  "image rendering works but is slower", RuntimeWarning)
+
+try:
+    import pybase64 as base64  # SIMD encoder, same API as the stdlib module
+except ImportError:
+    import base64
+
 # helper: small palette-to-name mapping for color captchas (common colors)
 _COMMON_COLOR_NAMES = {
     (255, 0, 0): "red",
@@ -40,12 +70,47 @@ _COMMON_COLOR_NAMES = {
     (0, 128, 0): "darkgreen",
     (75, 0, 130): "indigo",
 }
+# the same palette as arrays, for a vectorized nearest-color lookup
+_PAL_RGB = np.array(list(_COMMON_COLOR_NAMES.keys()), dtype=np.int32)
+_PAL_NAMES = list(_COMMON_COLOR_NAMES.values())
 
-def pil_to_data_uri(img: Image.Image, fmt="PNG") -> str:
+# WebP encodes several times faster than PNG's deflate and is smaller on the wire;
+# captcha images are single-use, so lossy quality 80 / fastest method is plenty.
+WEBP_SAVE_OPTIONS = {"quality": 80, "method": 0}
+# same reasoning for PNG: zlib level 1 is several times faster than the default 6
+PNG_SAVE_OPTIONS = {"optimize": False, "compress_level": 1}
+
+# WebP support is optional in a Pillow build: without the libwebp headers at
+# compile time it installs fine but has no encoder, so fall back to PNG
+WEBP_AVAILABLE = features.check("webp")
+if not WEBP_AVAILABLE:
+    warnings.warn("this Pillow build has no WebP support; serving captcha images "
+                  "as PNG (install libwebp-dev and rebuild Pillow-SIMD)", RuntimeWarning)
+IMAGE_FORMAT = "WEBP" if WEBP_AVAILABLE else "PNG"
+
+# content types of the raw bytes returned by pil_to_bytes() and synthesize_audio()
+IMAGE_MIMETYPE = "image/webp" if WEBP_AVAILABLE else "image/png"
+AUDIO_MIMETYPE = "audio/mpeg"
+
+def _encode(img: Image.Image, fmt) -> io.BytesIO:
     buffered = io.BytesIO()
-    img.save(buffered, format=fmt)
-    b64 = base64.b64encode(buffered.getvalue()).decode("ascii")
-    if fmt.upper() == "PNG":
+    if fmt.upper() == "WEBP":
+        img.save(buffered, format=fmt, **WEBP_SAVE_OPTIONS)
+    elif fmt.upper() == "PNG":
+        img.save(buffered, format=fmt, **PNG_SAVE_OPTIONS)
+    else:
+        img.save(buffered, format=fmt)
+    return buffered
+
+def pil_to_bytes(img: Image.Image, fmt=IMAGE_FORMAT) -> bytes:
+    return _encode(img, fmt).getvalue()
+
+def pil_to_data_uri(img: Image.Image, fmt=IMAGE_FORMAT) -> str:
+    # encode straight from the BytesIO buffer instead of a getvalue() copy
+    b64 = base64.b64encode(_encode(img, fmt).getbuffer()).decode("ascii")
+    if fmt.upper() == "WEBP":
+        return f"data:image/webp;base64,{b64}"
+    elif fmt.upper() == "PNG":
         return f"data:image/png;base64,{b64}"
     elif fmt.upper() in ("MP3", "MPEG"):
         return f"data:audio/mpeg;base64,{b64}"
@@ -56,20 +121,51 @@ def mp3_bytes_to_data_uri(mp3_bytes: bytes) -> str:
     b64 = base64.b64encode(mp3_bytes).decode("ascii")
     return f"data:audio/mpeg;base64,{b64}"
 
-def _random_font(size=32):
-    # Try some common font names; fallback to default
-    possible = ["arial.ttf", "DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"]
-    for p in possible:
+# Try some common font names; the first one that loads is used for every glyph
+_FONT_CANDIDATES = ["arial.ttf", "DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"]
+
+def _find_font_path():
+    for p in _FONT_CANDIDATES:
         try:
-            return ImageFont.truetype(p, size)
+            ImageFont.truetype(p, 12)
+            return p
         except Exception:
             continue
+    return None
+
+_FONT_PATH = _find_font_path()
+
+@functools.lru_cache(maxsize=128)
+def _font_cached(path, size):
+    return ImageFont.truetype(path, size)
+
+def _random_font(size=32):
+    # called per character: reuse the parsed font instead of probing the filesystem
+    if _FONT_PATH:
+        return _font_cached(_FONT_PATH, size)
     return ImageFont.load_default()
 
 # ---------------------------
 # Image renderer (word or decorative)
 # ---------------------------
-def create_image_from_description(description: str, width=420, height=200, seed=None) -> str:
+def _rotated_size(w, h, angle):
+    # size Image.rotate(..., expand=1) gives a w x h image: the same corner
+    # transform and ceil/floor rounding PIL uses, without rendering anything
+    a = -math.radians(angle)
+    c, s = round(math.cos(a), 15), round(math.sin(a), 15)
+    xs, ys = [], []
+    for x, y in ((0, 0), (w, 0), (w, h), (0, h)):
+        x, y = x - w / 2.0, y - h / 2.0
+        xs.append(c * x + s * y + w / 2.0)
+        ys.append(-s * x + c * y + h / 2.0)
+    return (math.ceil(max(xs)) - math.floor(min(xs)),
+            math.ceil(max(ys)) - math.floor(min(ys)))
+
+_QUOTED_WORD_RE = re.compile(r"'([^']+)'")
+_TOKEN_RE = re.compile(r"[A-Za-z0-9]+")
+_MARKER_RE = re.compile(r"\b(click|point|ring|marker|dot|target)\b", re.I)
+
+def render_image_from_description(description: str, width=420, height=200, seed=None) -> Image.Image:
     """
     Render an image that matches a textual description enough to be human-usable.
     NOTE: The authoritative captcha 'solution' must be supplied by the AI model (gemini_client).
@@ -77,64 +173,95 @@ def create_image_from_description(description: str, width=420, height=200, seed=
     background noise, and optional "markers" (rings) if description hints at a target point.
     """
     rnd = random.Random(seed)
-    # pick a dark-to-mid background
-    bg = (rnd.randint(10,80), rnd.randint(10,80), rnd.randint(10,80))
-    img = Image.new("RGB", (width, height), bg)
-    draw = ImageDraw.Draw(img)
-
-    # background texture: wavy lines + specks
-    for _ in range(18):
-        x0 = rnd.randint(-20, width + 20)
-        y0 = rnd.randint(-20, height + 20)
-        x1 = rnd.randint(-20, width + 20)
-        y1 = rnd.randint(-20, height + 20)
-        color = (rnd.randint(40,140), rnd.randint(40,140), rnd.randint(40,140))
-        draw.line([x0, y0, x1, y1], fill=color, width=rnd.randint(1,3))
-
-    for _ in range(12):
-        x = rnd.randint(0, width)
-        y = rnd.randint(0, height)
-        r = rnd.randint(6, 28)
-        outline = (rnd.randint(40,120), rnd.randint(40,120), rnd.randint(40,120))
-        draw.ellipse([x-r, y-r, x+r, y+r], outline=outline)
 
     # parse description: detect quoted word or last alpha token
-    import re
     word = None
-    m = re.search(r"'([^']+)'", description)
+    m = _QUOTED_WORD_RE.search(description)
     if m:
         word = m.group(1)
     else:
-        toks = re.findall(r"[A-Za-z0-9]+", description)
+        toks = _TOKEN_RE.findall(description)
         if toks:
             # often descriptions include many tokens; pick a short token likely to be a word
             word = max(toks, key=lambda t: (1.0 / (len(t) + 0.1)) if len(t) <= 8 else 0)  # bias short words
 
     # If the description contains "point" or "click" we add a subtle marker (visual only)
-    wants_marker = bool(re.search(r"\b(click|point|ring|marker|dot|target)\b", description, re.I))
+    wants_marker = bool(_MARKER_RE.search(description))
+
+    # pick a dark-to-mid background
+    bg = (rnd.randint(10,80), rnd.randint(10,80), rnd.randint(10,80))
+    # Opaque axis-aligned fills are written straight into the pixel buffer;
+    # strokes, outlines, polygons and rotated text go through ImageDraw after.
+    arr = np.empty((height, width, 3), dtype=np.uint8)
+    arr[:] = bg
+
+    # purely decorative images pick their shapes up front so the rectangles can
+    # be painted into the buffer (they sit beneath the background texture)
+    shape_types = [] if word else [rnd.choice(["ellipse", "rect", "polygon"]) for _ in range(6)]
+    for shape_type in shape_types:
+        if shape_type == "rect":
+            x0 = rnd.randint(0, width//2)
+            y0 = rnd.randint(0, height//2)
+            x1 = x0 + rnd.randint(40, width//2)
+            y1 = y0 + rnd.randint(30, height//2)
+            fill = (rnd.randint(80,220), rnd.randint(80,220), rnd.randint(80,220))
+            arr[y0:y1+1, x0:x1+1] = fill
+
+    img = Image.fromarray(arr, "RGB")
+    draw = ImageDraw.Draw(img)
+
+    # background texture: wavy lines + specks. These are the bulk of the random
+    # draws, so they come from one NumPy generator in a few vectorized calls.
+    rng = np.random.default_rng(seed)
+    line_pts = rng.integers((-20, -20, -20, -20), (width + 21, height + 21, width + 21, height + 21), size=(18, 4))
+    line_colors = rng.integers(40, 141, size=(18, 3))
+    line_widths = rng.integers(1, 4, size=18)
+    for pts, color, lw in zip(line_pts.tolist(), line_colors.tolist(), line_widths.tolist()):
+        draw.line(pts, fill=tuple(color), width=lw)
+
+    centers = rng.integers((0, 0), (width + 1, height + 1), size=(12, 2))
+    radii = rng.integers(6, 29, size=(12, 1))
+    boxes = np.hstack((centers - radii, centers + radii))
+    outlines = rng.integers(40, 121, size=(12, 3))
+    for box, outline in zip(boxes.tolist(), outlines.tolist()):
+        draw.ellipse(box, outline=tuple(outline))
 
     if word:
         # Draw jittered, rotated characters with variable fonts and sizes
         cx = width // 8 + rnd.randint(-20, 20)
         # reduce word length to reasonable size
         wword = str(word)[:10]
-        for ch in wword:
-            fsize = rnd.randint(28, 48)
-            font = _random_font(fsize)
-            w, h = draw.textsize(ch, font=font)
-            # place char on its own small image, rotate, then paste
-            char_img = Image.new("RGBA", (w*3, h*3), (0,0,0,0))
+        # every glyph is rotated in a buffer just big enough for it and composited
+        # onto one shared text layer, which is pasted onto the image once
+        text_layer = Image.new("RGBA", (width, height), (0,0,0,0))
+        # per-glyph jitter (size, color, angle, y offset, advance) sampled up
+        # front so the loop below is only PIL calls
+        n = len(wword)
+        sizes = rng.integers(28, 49, n).tolist()
+        fills = rng.integers(180, 256, size=(n, 3)).tolist()
+        angles = rng.integers(-50, 51, n).tolist()
+        yoffs = rng.integers(-14, 15, n).tolist()
+        steps = (0.8 + rng.random(n) * 0.6).tolist()
+        for i, ch in enumerate(wword):
+            font = _random_font(sizes[i])
+            # textsize is gone in Pillow 10; the bbox right/bottom from the origin is the same size
+            _, _, w, h = draw.textbbox((0, 0), ch, font=font)
+            char_img = Image.new("RGBA", (w, h), (0,0,0,0))
             cd = ImageDraw.Draw(char_img)
-            fill = (rnd.randint(180,255), rnd.randint(180,255), rnd.randint(180,255))
-            cd.text((w, h), ch, font=font, fill=fill)
-            rot = char_img.rotate(rnd.randint(-50, 50), resample=Image.BICUBIC, expand=1)
+            cd.text((0, 0), ch, font=font, fill=tuple(fills[i]))
+            rot = char_img.rotate(angles[i], resample=Image.BILINEAR, expand=1)
             # y position jitter
-            y = (height - h) // 2 + rnd.randint(-14, 14)
-            try:
-                img.paste(rot, (cx, y), rot)
-            except Exception:
-                img.alpha_composite(rot, dest=(cx, y))
-            cx += int(w * (0.8 + rnd.random() * 0.6))
+            y = (height - h) // 2 + yoffs[i]
+            # the glyph used to sit in the middle of a w*3 x h*3 canvas pasted at
+            # (cx, y), i.e. centred on that canvas's rotated bounds; keep it there
+            bw, bh = _rotated_size(w * 3, h * 3, angles[i])
+            dx = cx + (bw - rot.width) // 2
+            dy = y + (bh - rot.height) // 2
+            # alpha_composite can't take a negative dest: crop the overhang instead
+            text_layer.alpha_composite(rot, dest=(max(dx, 0), max(dy, 0)),
+                                       source=(max(-dx, 0), max(-dy, 0)))
+            cx += int(w * steps[i])
+        img.paste(text_layer, (0, 0), text_layer)
 
         # add crossing lines and blur to make OCR harder
         for _ in range(3 + rnd.randint(0,2)):
@@ -145,27 +272,21 @@ def create_image_from_description(description: str, width=420, height=200, seed=
             draw.line([x0,y0,x1,y1], fill=(rnd.randint(80,200), rnd.randint(80,200), rnd.randint(80,200)), width=rnd.randint(1,3))
         img = img.filter(ImageFilter.GaussianBlur(radius=rnd.choice([0.5, 0.8, 1.0])))
     else:
-        # purely decorative: random shapes and translucent polygons
-        for i in range(6):
-            shape_type = rnd.choice(["ellipse", "rect", "polygon"])
+        # purely decorative: random shapes and translucent polygons (rectangles already painted)
+        for shape_type in shape_types:
             if shape_type == "ellipse":
                 x = rnd.randint(20, width-20)
                 y = rnd.randint(20, height-20)
                 r = rnd.randint(14, 50)
                 fill = (rnd.randint(100,240), rnd.randint(100,240), rnd.randint(100,240))
                 draw.ellipse([x-r,y-r,x+r,y+r], fill=fill, outline=None)
-            elif shape_type == "rect":
-                x0 = rnd.randint(0, width//2)
-                y0 = rnd.randint(0, height//2)
-                x1 = x0 + rnd.randint(40, width//2)
-                y1 = y0 + rnd.randint(30, height//2)
-                fill = (rnd.randint(80,220), rnd.randint(80,220), rnd.randint(80,220))
-                draw.rectangle([x0,y0,x1,y1], fill=fill)
-            else:
+            elif shape_type == "polygon":
                 pts = [(rnd.randint(0,width), rnd.randint(0,height)) for _ in range(3 + rnd.randint(0,3))]
                 draw.polygon(pts, fill=(rnd.randint(80,220), rnd.randint(80,220), rnd.randint(80,220)))
 
-        img = img.filter(ImageFilter.GaussianBlur(radius=0.6))
+        # a single moving-sum box pass is enough softening for shapes; the word
+        # branch keeps GaussianBlur since there it is part of the OCR scrambling
+        img = img.filter(ImageFilter.BoxBlur(1))
 
     # If marker desired, draw a faint ring at a random-ish location to hint a point without revealing exact coordinates.
     marker_info = None
@@ -179,65 +300,185 @@ def create_image_from_description(description: str, width=420, height=200, seed=
         # return marker coords in metadata if desired (but authoritative sol must come from AI)
         marker_info = {"approx_x": mx, "approx_y": my, "radius": r}
 
-    return pil_to_data_uri(img)
+    return img
+
+def create_image_from_description(description: str, width=420, height=200, seed=None) -> str:
+    return pil_to_data_uri(render_image_from_description(description, width, height, seed))
 
 # ---------------------------
 # Color box renderer
 # ---------------------------
-def create_color_image(color_rgb: Tuple[int,int,int], width=240, height=140, seed=None) -> str:
+def render_color_image(color_rgb: Tuple[int,int,int], width=240, height=140, seed=None) -> Image.Image:
     """
-    Renders a rectangular color swatch with slight noise, returns PNG data URI.
+    Renders a rectangular color swatch with slight noise.
     color_rgb: (r,g,b)
     """
-    rnd = random.Random(seed)
-    img = Image.new("RGB", (width, height), color_rgb)
-    draw = ImageDraw.Draw(img)
+    rng = np.random.default_rng(seed)
+    # color_rgb comes from the model: clamp into 0..255 before it meets uint8
+    rgb = np.clip(np.asarray(color_rgb, dtype=np.int64), 0, 255)
+    arr = np.empty((height, width, 3), dtype=np.uint8)
+    arr[:] = rgb
+
+    # add tiny overlay noise: sample every dot up front and write them in one go
+    n = int(width * height * 0.002)
+    ys = rng.integers(0, height, n)
+    xs = rng.integers(0, width, n)
+    jitter = rng.integers(-8, 9, size=(n, 3))
+    arr[ys, xs] = np.clip(rgb + jitter, 0, 255)
 
-    # add tiny semitransparent overlay noise
-    for _ in range(int(width * height * 0.002)):
-        x = rnd.randint(0, width-1)
-        y = rnd.randint(0, height-1)
-        dot = (min(255, color_rgb[0] + rnd.randint(-8,8)),
-               min(255, color_rgb[1] + rnd.randint(-8,8)),
-               min(255, color_rgb[2] + rnd.randint(-8,8)))
-        draw.point((x,y), fill=dot)
+    # maybe add a thin border (1px edge rows/columns, same as an outlined rectangle)
+    border_color = np.maximum(rgb - 30, 0)
+    arr[[0, -1], :] = border_color
+    arr[:, [0, -1]] = border_color
 
-    # maybe add a thin border
-    border_color = tuple(max(0, c-30) for c in color_rgb)
-    draw.rectangle([0, 0, width-1, height-1], outline=border_color)
+    return Image.fromarray(arr, "RGB")
 
-    return pil_to_data_uri(img)
+def create_color_image(color_rgb: Tuple[int,int,int], width=240, height=140, seed=None) -> str:
+    return pil_to_data_uri(render_color_image(color_rgb, width, height, seed))
 
 def guess_common_color_name(color_rgb: Tuple[int,int,int]) -> str:
     """
     Returns the nearest color name in our small lookup, fallback to hex-like name.
     """
-    best = None
-    best_dist = None
-    for k, name in _COMMON_COLOR_NAMES.items():
-        dist = math.sqrt(sum((a-b)**2 for a,b in zip(k, color_rgb)))
-        if best_dist is None or dist < best_dist:
-            best_dist = dist
-            best = name
-    if best_dist is not None and best_dist < 100:
-        return best
+    # squared distances rank the same as euclidean ones, so no sqrt
+    d2 = ((_PAL_RGB - np.asarray(color_rgb, dtype=np.int32)) ** 2).sum(axis=1)
+    i = int(d2.argmin())
+    if d2[i] < 100 ** 2:
+        return _PAL_NAMES[i]
     # fallback: hex
     return "#{:02x}{:02x}{:02x}".format(*color_rgb)
 
 # ---------------------------
 # Audio renderer
 # ---------------------------
-def create_audio_from_text(text: str, lang="en") -> str:
+# gTTS is a network round-trip per call. Results are kept in an in-process LRU
+# and in TTS_CACHE_DIR (shared by every worker, survives restarts); disk entries
+# older than TTS_CACHE_MAX_AGE are re-synthesized and periodically swept.
+def _default_tts_cache_dir():
+    # per-user, not a fixed name in the shared temp dir: another local user
+    # could create that first and read or replace the cached answer audio
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "captcha_tts")
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR") or _default_tts_cache_dir()
+TTS_CACHE_MAX_AGE = 24 * 3600
+TTS_SWEEP_SECONDS = 3600
+_tts_last_sweep = 0.0
+_tts_dir_ok = None  # whether TTS_CACHE_DIR passed _tts_dir_private(); None until checked
+_DEFAULT_TTS_TEXT = "Please type the word shown."
+
+# Background synthesis: the generator starts TTS as soon as an audio captcha is
+# issued so the network round-trip overlaps the page loading it. The pool is
+# created on first use (never before gunicorn forks).
+TTS_PREFETCH_WORKERS = 8
+_tts_pool = None
+_tts_pending = {}  # (text, lang) -> Future still in flight
+_tts_lock = threading.Lock()
+
+def _tts_path(text, lang):
+    key = hashlib.sha1(f"{text}|{lang}".encode()).hexdigest()
+    return os.path.join(TTS_CACHE_DIR, key + ".mp3")
+
+def _tts_dir_private():
     """
-    Uses gTTS to produce an mp3 data URI. Note: network required for TTS backend.
+    Create TTS_CACHE_DIR (mode 0700) if needed and check, once, that it is
+    ours and closed to everyone else. If not, audio is only cached in memory.
     """
-    if not text:
-        text = "Please type the word shown."
+    global _tts_dir_ok
+    if _tts_dir_ok is None:
+        try:
+            os.makedirs(TTS_CACHE_DIR, mode=0o700, exist_ok=True)
+            st = os.stat(TTS_CACHE_DIR)
+            ok = st.st_uid == os.geteuid() and not st.st_mode & 0o077
+        except OSError:
+            ok = False
+        if not ok:
+            warnings.warn(f"TTS cache dir {TTS_CACHE_DIR!r} is not a directory private to "
+                          "this user (owner-only, mode 0700); caching audio in memory only",
+                          RuntimeWarning)
+        _tts_dir_ok = ok
+    return _tts_dir_ok
+
+def _sweep_tts_cache(now):
+    global _tts_last_sweep
+    if now - _tts_last_sweep < TTS_SWEEP_SECONDS:
+        return
+    _tts_last_sweep = now
+    for entry in os.scandir(TTS_CACHE_DIR):
+        try:
+            if now - entry.stat().st_mtime > TTS_CACHE_MAX_AGE:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+@functools.lru_cache(maxsize=1024)
+def _cached_tts(text, lang):
+    disk = _tts_dir_private()
+    path = _tts_path(text, lang)
+    now = time.time()
+    try:
+        if disk and now - os.path.getmtime(path) < TTS_CACHE_MAX_AGE:
+            with open(path, "rb") as f:
+                return f.read()
+    except OSError:
+        pass
+
     tts = gTTS(text=text, lang=lang)
     bio = io.BytesIO()
     tts.write_to_fp(bio)
-    mp3_bytes = bio.getvalue()
-    return mp3_bytes_to_data_uri(mp3_bytes)
+    mp3 = bio.getvalue()
+
+    # the disk tier is best-effort; write-then-rename so readers never see a partial file
+    if not disk:
+        return mp3
+    try:
+        fd, tmp = tempfile.mkstemp(dir=TTS_CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(mp3)
+        os.replace(tmp, path)
+        _sweep_tts_cache(now)
+    except OSError:
+        pass
+    return mp3
+
+def prefetch_audio(text: str, lang="en"):
+    """
+    Start synthesizing `text` in the background; a later synthesize_audio()
+    call for it waits on that instead of making its own request.
+    """
+    global _tts_pool
+    key = (text or _DEFAULT_TTS_TEXT, lang)
+    with _tts_lock:
+        if key in _tts_pending:
+            return
+        if _tts_pool is None:
+            _tts_pool = ThreadPoolExecutor(max_workers=TTS_PREFETCH_WORKERS, thread_name_prefix="tts")
+        fut = _tts_pool.submit(_cached_tts, *key)
+        _tts_pending[key] = fut
+    fut.add_done_callback(lambda f: _tts_done(key))
+
+def _tts_done(key):
+    with _tts_lock:
+        _tts_pending.pop(key, None)
+
+def synthesize_audio(text: str, lang="en") -> bytes:
+    """
+    Uses gTTS to produce mp3 bytes. Note: network required for TTS backend
+    on a cache miss.
+    """
+    if not text:
+        text = _DEFAULT_TTS_TEXT
+    with _tts_lock:
+        fut = _tts_pending.get((text, lang))
+    if fut is not None:
+        try:
+            return fut.result()
+        except Exception:
+            pass  # a failed prefetch is retried inline below
+    return _cached_tts(text, lang)
+
+def create_audio_from_text(text: str, lang="en") -> str:
+    return mp3_bytes_to_data_uri(synthesize_audio(text, lang))
 
 # ---------------------------
 # Pattern UI helper
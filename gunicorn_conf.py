@@ -0,0 +1,20 @@
+# gunicorn_conf.py
+"""
+Production server settings:  gunicorn -c gunicorn_conf.py app:app
+
+Sessions, the verify batcher and the render pool live in process memory, so
+by default a single worker process serves all traffic; its threads overlap
+slow model calls, TTS and image rendering. Only raise WEB_CONCURRENCY once
+sessions are kept in a store shared between processes.
+"""
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+timeout = 60
+
+# import the app (PIL, fonts, compressed index page) once in the master;
+# background threads start lazily, so each worker gets its own after fork
+preload_app = True
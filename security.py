@@ -3,6 +3,7 @@ import os
 import time
 import hmac
 import hashlib
+import binascii
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -12,17 +13,36 @@ if not HMAC_SECRET:
 
 WINDOW_SECONDS = 300  # 5-minute window for signature tolerance
 
-def sign_payload(session_id: str, payload_str: str) -> str:
-    ts = str(int(time.time() // WINDOW_SECONDS))
-    msg = f"{session_id}|{payload_str}|{ts}"
-    return hmac.new(HMAC_SECRET.encode(), msg.encode(), hashlib.sha256).hexdigest()
+# Keyed once at import; copy() reuses the already-padded key state instead of
+# re-deriving it on every sign/verify.
+_MAC = hmac.new(HMAC_SECRET.encode(), digestmod=hashlib.sha256)
 
-def verify_signature(session_id: str, payload_str: str, signature: str) -> bool:
+# The signed message is b"session_id|payload|ts". Only ts differs between the
+# windows verify_signature tries, so the prefix is absorbed once and the MAC
+# state is copied per window.
+def _prefixed(session_id: str, payload: bytes):
+    h = _MAC.copy()
+    h.update(session_id.encode() + b"|" + payload + b"|")
+    return h
+
+def _mac_at(prefixed, ts: int) -> bytes:
+    h = prefixed.copy()
+    h.update(str(ts).encode())
+    return h.digest()
+
+def sign_payload(session_id: str, payload: bytes) -> str:
+    ts = int(time.time() // WINDOW_SECONDS)
+    mac = _mac_at(_prefixed(session_id, payload), ts)
+    return binascii.hexlify(mac).decode("ascii")  # hex only on the wire
+
+def verify_signature(session_id: str, payload: bytes, signature: str) -> bool:
+    try:
+        sig = binascii.unhexlify(signature)
+    except (TypeError, ValueError):
+        return False
+    prefixed = _prefixed(session_id, payload)
     ts_now = int(time.time() // WINDOW_SECONDS)
     for offset in (0, -1):  # allow current and previous window
-        ts = str(ts_now + offset)
-        msg = f"{session_id}|{payload_str}|{ts}"
-        expected = hmac.new(HMAC_SECRET.encode(), msg.encode(), hashlib.sha256).hexdigest()
-        if hmac.compare_digest(expected, signature):
+        if hmac.compare_digest(_mac_at(prefixed, ts_now + offset), sig):
             return True
     return False
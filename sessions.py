@@ -1,49 +1,176 @@
 # sessions.py
-import uuid
+import os
 import time
 import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+
+SESSION_TTL = 3600  # seconds; a session's expiry is fixed when it's created
+MAX_SESSIONS = 100_000  # hard cap per process; the oldest sessions go first
+
+def _now():
+    # session timestamps are whole monotonic seconds: integer compares, and
+    # wall-clock jumps can't expire or resurrect sessions
+    return int(time.monotonic())
+
+@dataclass(slots=True)
+class SessionRec:
+    """
+    One session. Validate-attempt counters live in AttemptTracker, not here.
+    """
+    created: int
+    expires: int
+    captcha: dict = None
+    generation_count: int = 0
+
+class AttemptTracker:
+    """
+    Validate-attempt counters kept apart from the session records.
+    Locks are sharded by session id so concurrent validates for different
+    sessions don't serialize on the session store lock.
+    """
+    SHARDS = 64
+
+    def __init__(self):
+        self.locks = [threading.Lock() for _ in range(self.SHARDS)]
+        self.counts = {}
+
+    def _lock(self, sid):
+        return self.locks[hash(sid) % self.SHARDS]
+
+    def count(self, sid):
+        rec = self.counts.get(sid)
+        return rec[0] if rec else 0
+
+    def try_attempt(self, sid, now, limit, window):
+        """
+        Record an attempt unless `limit` attempts were already made and the
+        last one was less than `window` seconds ago. Returns False if blocked.
+        """
+        with self._lock(sid):
+            n, last = self.counts.get(sid, (0, 0.0))
+            if n >= limit and now - last < window:
+                return False
+            self.counts[sid] = (n + 1, now)
+            return True
+
+    def reset(self, sid):
+        with self._lock(sid):
+            self.counts.pop(sid, None)
 
 class InMemorySession:
+    """
+    Sessions split over SHARDS (lock, dict) pairs by session id, so
+    requests for different sessions don't contend on one mutex. get() returns
+    a snapshot copy taken under the shard lock, so its fields are consistent
+    with each other; writes go through update() or transaction(), which lock
+    only the session's shard too.
+
+    A session is dropped when it's found expired on access; the rest are
+    evicted by a background sweeper every SWEEP_SECONDS, off the request path.
+    Every session has the same lifetime, so shards (kept in creation order)
+    always hold their expired sessions at the front; there is no full scan.
+    The same order bounds memory: a shard over its share of MAX_SESSIONS
+    drops its oldest session, which is also the next one due to expire.
+    """
+    SHARDS = 16
+    SWEEP_SECONDS = 60
+    EVICT_BATCH = 64  # evictions per shard-lock hold while sweeping
+
     def __init__(self):
-        self.lock = threading.Lock()
-        self.sessions = {}
-        self.last_cleanup = time.time()
+        self.shards = [(threading.Lock(), OrderedDict()) for _ in range(self.SHARDS)]
+        self.shard_cap = MAX_SESSIONS // self.SHARDS
+        self.rate = AttemptTracker()
+        self.sweeper = None
+        self.sweeper_lock = threading.Lock()
+
+    def _shard(self, sid):
+        return self.shards[hash(sid) & (self.SHARDS - 1)]
 
     def create(self):
-        sid = uuid.uuid4().hex[:12]
-        with self.lock:
-            self.sessions[sid] = {
-                "created": time.time(),
-                "captcha": None,
-                "attempts": 0,
-                "last_attempt": 0,
-                "generation_count": 0
-            }
-            self._cleanup()
+        sid = os.urandom(6).hex()  # 48 random bits, 12 hex chars
+        lock, sessions = self._shard(sid)
+        now = _now()
+        with lock:
+            sessions[sid] = SessionRec(created=now, expires=now + SESSION_TTL)
+            if len(sessions) > self.shard_cap:
+                oldest, _ = sessions.popitem(last=False)
+                self.rate.reset(oldest)
+        self._ensure_sweeper()
         return sid
 
+    def _ensure_sweeper(self):
+        # started lazily so a forked worker process gets its own thread
+        if self.sweeper is not None and self.sweeper.is_alive():
+            return
+        with self.sweeper_lock:
+            if self.sweeper is None or not self.sweeper.is_alive():
+                self.sweeper = threading.Thread(target=self._sweep_loop, daemon=True)
+                self.sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.SWEEP_SECONDS)
+            self._sweep(_now())
+
+    def _sweep(self, now):
+        # the shard lock is released between batches so requests interleave
+        for lock, sessions in self.shards:
+            evicted = self.EVICT_BATCH
+            while evicted == self.EVICT_BATCH:
+                with lock:
+                    evicted = self._evict_expired(sessions, now)
+
+    def _evict_expired(self, sessions, now):
+        # caller holds the shard lock; returns how many sessions were dropped
+        for n in range(self.EVICT_BATCH):
+            if not sessions:
+                return n
+            oldest, s = next(iter(sessions.items()))
+            if now <= s.expires:
+                return n
+            sessions.popitem(last=False)  # drops `oldest` without hashing it again
+            self.rate.reset(oldest)
+        return self.EVICT_BATCH
+
+    def _live(self, sid, sessions):
+        # caller holds the shard lock
+        s = sessions.get(sid)
+        if not s:
+            return None
+        if _now() > s.expires:
+            sessions.pop(sid, None)
+            self.rate.reset(sid)
+            return None
+        return s
+
     def get(self, sid):
-        with self.lock:
-            s = self.sessions.get(sid)
-            if not s:
-                return None
-            if time.time() - s["created"] > 3600:
-                del self.sessions[sid]
-                return None
-            return s
+        lock, sessions = self._shard(sid)
+        # copy under the lock: replace() reads field by field, and an update()
+        # landing mid-copy would mix old and new fields
+        with lock:
+            s = self._live(sid, sessions)
+            return replace(s) if s else None
+
+    @contextmanager
+    def transaction(self, sid):
+        """
+        Hold the session's shard lock for the whole block and yield the live
+        SessionRec (None if missing/expired). Reads and writes made to it
+        inside the block are atomic with respect to every other store
+        operation on that session.
+        """
+        lock, sessions = self._shard(sid)
+        with lock:
+            yield self._live(sid, sessions)
 
     def update(self, sid, data):
-        with self.lock:
-            if sid in self.sessions:
-                self.sessions[sid].update(data)
-                self._cleanup()
-
-    def _cleanup(self):
-        now = time.time()
-        if now - self.last_cleanup > 300:
-            expired = [k for k, v in self.sessions.items() if now - v["created"] > 3600]
-            for k in expired:
-                del self.sessions[k]
-            self.last_cleanup = now
+        lock, sessions = self._shard(sid)
+        with lock:
+            s = sessions.get(sid)
+            if s:
+                for field, value in data.items():
+                    setattr(s, field, value)
 
 session_store = InMemorySession()